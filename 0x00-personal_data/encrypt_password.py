@@ -1,34 +1,593 @@
 #!/usr/bin/env python3
 """ Encrypting passwords """
+import asyncio
+import base64
 import bcrypt
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import (Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
 
-def hash_password(password: str) -> bytes:
+# bcrypt releases the GIL, so threads hash on all cores at once
+MAX_WORKERS = os.cpu_count() or 1
+# Number of passwords sent to a worker process at a time by the bulk API
+BULK_CHUNKSIZE = 16
+# bcrypt cost factor of new hashes: each extra round doubles the hashing time.
+# Set it with BCRYPT_ROUNDS, e.g. from the output of this script, which
+# calibrates it for the host.
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+# Name of the hasher used for new hashes, see HASHERS
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'bcrypt')
+# scrypt parameters: log2 of the CPU/memory cost, block size, parallelism
+SCRYPT_LN = int(os.getenv('SCRYPT_LN', 14))
+SCRYPT_R = int(os.getenv('SCRYPT_R', 8))
+SCRYPT_P = int(os.getenv('SCRYPT_P', 1))
+
+_executor = None
+_executor_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+class BcryptHasher:
+    """
+    bcrypt password hasher, producing "$2b$<rounds>$..." hashes.
+    """
+
+    prefixes = (b'$2a$', b'$2b$', b'$2y$')
+
+    def hash(self, password: bytes) -> bytes:
+        """
+        Hash a password with a new salt at BCRYPT_ROUNDS.
+
+        Args:
+        password (bytes): The encoded password.
+
+        Returns:
+        bytes: The self-describing hash.
+        """
+        return bcrypt.hashpw(password, bcrypt.gensalt(BCRYPT_ROUNDS))
+
+    def verify(self, hashed_password: bytes, password: bytes) -> bool:
+        """
+        Check a password against a hash made by this hasher.
+
+        Args:
+        hashed_password (bytes): The stored hash.
+        password (bytes): The encoded password.
+
+        Returns:
+        bool: True if the password matches the hash, False otherwise.
+        """
+        return bcrypt.checkpw(password, hashed_password)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """
+        Tell whether a hash was made with another cost than BCRYPT_ROUNDS.
+
+        Args:
+        hashed_password (bytes): The stored hash.
+
+        Returns:
+        bool: True if the password should be hashed again, False otherwise.
+        """
+        return hash_rounds(hashed_password) != BCRYPT_ROUNDS
+
+
+class ScryptHasher:
+    """
+    scrypt password hasher, producing
+    "$scrypt$ln=<log2 n>,r=<r>,p=<p>$<salt>$<hash>" hashes with base64
+    encoded salt and hash.
+    """
+
+    prefixes = (b'$scrypt$',)
+
+    def hash(self, password: bytes) -> bytes:
+        """
+        Hash a password with a new salt at SCRYPT_LN, SCRYPT_R and SCRYPT_P.
+
+        Args:
+        password (bytes): The encoded password.
+
+        Returns:
+        bytes: The self-describing hash.
+        """
+        salt = os.urandom(16)
+        digest = self._derive(password, salt, SCRYPT_LN, SCRYPT_R, SCRYPT_P)
+        return b'$scrypt$ln=%d,r=%d,p=%d$%s$%s' % (
+            SCRYPT_LN, SCRYPT_R, SCRYPT_P,
+            base64.b64encode(salt), base64.b64encode(digest))
+
+    def verify(self, hashed_password: bytes, password: bytes) -> bool:
+        """
+        Check a password against a hash made by this hasher.
+
+        Args:
+        hashed_password (bytes): The stored hash.
+        password (bytes): The encoded password.
+
+        Returns:
+        bool: True if the password matches the hash, False otherwise.
+        """
+        (ln, r, p), salt, digest = self._parse(hashed_password)
+        return hmac.compare_digest(
+            self._derive(password, salt, ln, r, p), digest)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """
+        Tell whether a hash was made with other parameters than the current
+        ones.
+
+        Args:
+        hashed_password (bytes): The stored hash.
+
+        Returns:
+        bool: True if the password should be hashed again, False otherwise.
+        """
+        params = self._parse(hashed_password)[0]
+        return params != (SCRYPT_LN, SCRYPT_R, SCRYPT_P)
+
+    @staticmethod
+    def _parse(hashed_password: bytes) -> Tuple[Tuple[int, int, int],
+                                                bytes, bytes]:
+        """
+        Split a scrypt hash into its parameters, salt and digest.
+
+        Args:
+        hashed_password (bytes): The stored hash.
+
+        Returns:
+        Tuple: The (ln, r, p) parameters, the salt and the digest.
+        """
+        _, _, params, salt, digest = hashed_password.split(b'$')
+        values = dict(param.split(b'=') for param in params.split(b','))
+        return ((int(values[b'ln']), int(values[b'r']), int(values[b'p'])),
+                base64.b64decode(salt), base64.b64decode(digest))
+
+    @staticmethod
+    def _derive(password: bytes, salt: bytes, ln: int, r: int,
+                p: int) -> bytes:
+        """
+        Run scrypt with the given parameters.
+
+        Args:
+        password (bytes): The encoded password.
+        salt (bytes): The salt.
+        ln (int): log2 of the CPU/memory cost.
+        r (int): The block size.
+        p (int): The parallelism.
+
+        Returns:
+        bytes: The 32 bytes digest.
+        """
+        n = 1 << ln
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                              maxmem=_scrypt_maxmem(n, r, p), dklen=32)
+
+
+def _scrypt_maxmem(n: int, r: int, p: int) -> int:
+    """
+    Compute the memory scrypt needs, as checked by OpenSSL: 128 * r * p
+    bytes for the p blocks plus 128 * r * (n + 2) bytes for the work area.
+
+    Args:
+    n (int): The CPU/memory cost.
+    r (int): The block size.
+    p (int): The parallelism.
+
+    Returns:
+    int: The number of bytes to allow, with 1 MiB of headroom.
+    """
+    return 128 * r * (n + p + 2) + (1 << 20)
+
+
+# Registered hashers, by name. Stored hashes are matched to their hasher by
+# prefix, so changing PASSWORD_HASHER keeps older hashes valid.
+HASHERS: Dict[str, object] = {
+    'bcrypt': BcryptHasher(),
+    'scrypt': ScryptHasher(),
+}
+
+
+def register_hasher(name: str, hasher: object) -> None:
+    """
+    Register a password hasher, making its hashes verifiable and its name
+    usable as PASSWORD_HASHER.
+
+    Args:
+    name (str): The name of the hasher.
+    hasher (object): An object with a prefixes tuple and hash, verify and
+        needs_rehash methods, like BcryptHasher.
+    """
+    HASHERS[name] = hasher
+
+
+def hasher_for(hashed_password: bytes) -> object:
+    """
+    Find the hasher that made a hash, from the prefix of the hash.
+
+    Args:
+    hashed_password (bytes): The stored hash.
+
+    Returns:
+    object: The registered hasher.
+
+    Raises:
+    ValueError: If no registered hasher knows the prefix of the hash.
+    """
+    for hasher in HASHERS.values():
+        if hashed_password.startswith(hasher.prefixes):
+            return hasher
+    raise ValueError("Unknown password hash format")
+
+
+def hash_password(password: str, rounds: int = None) -> bytes:
     """
     - User passwords should NEVER be stored in plain text in a database.
     - Implement a hash_password function that expects one string argument name
         password and returns a salted, hashed password, which is a byte string.
     - Use the bcrypt package to perform the hashing (with hashpw).
+    - The hash is made by the PASSWORD_HASHER of HASHERS, bcrypt by default.
+    - Passing rounds forces a bcrypt hash at that cost factor. The cost is
+        recorded in the hash, so hashes of any cost stay valid for is_valid.
     """
 
     encode = password.encode()
-    hashed = bcrypt.hashpw(encode, bcrypt.gensalt())
+    if rounds is not None:
+        return bcrypt.hashpw(encode, bcrypt.gensalt(rounds))
+    hashed = HASHERS[PASSWORD_HASHER].hash(encode)
     return hashed
 
 
-def is_valid(hashed_password: bytes, password: str) -> bool:
+def hash_rounds(hashed_password: bytes) -> int:
+    """
+    Read the cost factor recorded in a bcrypt hash.
+
+    Args:
+    hashed_password (bytes): The salted, hashed password, e.g. b"$2b$12$...".
+
+    Returns:
+    int: The number of rounds the hash was computed with.
+    """
+    return int(hashed_password.split(b'$')[2])
+
+
+def calibrate_rounds(target: float = 0.25, min_rounds: int = MIN_ROUNDS,
+                     max_rounds: int = MAX_ROUNDS,
+                     apply: bool = False) -> int:
+    """
+    Find the highest bcrypt cost factor whose hashing time on this host fits
+    a latency budget.
+
+    The cost is raised one round at a time, as long as the next round, twice
+    as slow as the last measured one, is expected to fit the budget.
+
+    Args:
+    target (float): The latency budget of one hash, in seconds.
+    min_rounds (int): The lowest cost factor returned, even if too slow.
+    max_rounds (int): The highest cost factor tried.
+    apply (bool): Also make the result the BCRYPT_ROUNDS of this process.
+
+    Returns:
+    int: The calibrated number of rounds.
+    """
+    global BCRYPT_ROUNDS
+
+    def measure(rounds: int) -> float:
+        """Time one hash at the given cost factor."""
+        salt = bcrypt.gensalt(rounds)
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration password', salt)
+        return time.perf_counter() - start
+
+    rounds = min_rounds
+    elapsed = measure(rounds)
+    while rounds < max_rounds and elapsed * 2 <= target:
+        rounds += 1
+        elapsed = measure(rounds)
+    if elapsed > target and rounds > min_rounds:
+        rounds -= 1
+    if apply:
+        BCRYPT_ROUNDS = rounds
+    return rounds
+
+
+def is_valid(hashed_password: bytes, password: str,
+             on_rehash: Callable[[bytes, bytes], None] = None) -> bool:
     """
     Validates whether the provided password matches the hashed password.
 
     Args:
     hashed_password (bytes): The salted, hashed password.
     password (str): The password to validate.
+    on_rehash (Callable[[bytes, bytes], None]): Called with
+        hashed_password and a new hash of the password when it matches an
+        outdated hash (see needs_rehash), e.g. to store it. The new hash is
+        computed on the bcrypt worker pool, after this function has
+        returned, so on_rehash must only store it if the stored hash is
+        still hashed_password; otherwise it would undo a password change
+        made meanwhile. Failures of the rehash or of on_rehash are logged.
 
     Returns:
     bool: True if the password matches the hashed password, False otherwise.
     """
     valid = False
     encode = password.encode()
-    if bcrypt.checkpw(encode, hashed_password):
+    if hasher_for(hashed_password).verify(hashed_password, encode):
         valid = True
+        if on_rehash is not None and needs_rehash(hashed_password):
+            future = get_executor().submit(_rehash, hashed_password,
+                                           password, on_rehash)
+            future.add_done_callback(_log_failure)
     return valid
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """
+    Tell whether a hash was made by another hasher than PASSWORD_HASHER, or
+    with other parameters than its current ones (e.g. BCRYPT_ROUNDS).
+
+    Args:
+    hashed_password (bytes): The salted, hashed password.
+
+    Returns:
+    bool: True if the password should be hashed again, False otherwise.
+    """
+    hasher = hasher_for(hashed_password)
+    return hasher is not HASHERS[PASSWORD_HASHER] or \
+        hasher.needs_rehash(hashed_password)
+
+
+def _rehash(hashed_password: bytes, password: str,
+            on_rehash: Callable[[bytes, bytes], None]) -> None:
+    """
+    Hash a password at the current cost and hand the hash over.
+
+    Args:
+    hashed_password (bytes): The outdated hash the password matched.
+    password (str): The password, known to match hashed_password.
+    on_rehash (Callable[[bytes, bytes], None]): Called with hashed_password
+        and the new hash.
+    """
+    on_rehash(hashed_password, hash_password(password))
+
+
+def _log_failure(future: Future) -> None:
+    """
+    Log the exception of a background rehash, if it failed.
+
+    Args:
+    future (Future): The future of the finished rehash.
+    """
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Background password rehash failed",
+                     exc_info=future.exception())
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Return the thread pool running bcrypt off the caller's thread.
+
+    The pool is created on first use with MAX_WORKERS threads, which bounds
+    the number of hashes computed at the same time.
+
+    Returns:
+    ThreadPoolExecutor: The shared bcrypt worker pool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(MAX_WORKERS,
+                                           thread_name_prefix="bcrypt")
+    return _executor
+
+
+async def hash_password_async(password: str) -> bytes:
+    """
+    Hash a password on the bcrypt worker pool without blocking the event
+    loop.
+
+    Args:
+    password (str): The password to hash.
+
+    Returns:
+    bytes: The salted, hashed password.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), hash_password, password)
+
+
+async def is_valid_async(hashed_password: bytes, password: str) -> bool:
+    """
+    Validate a password on the bcrypt worker pool without blocking the event
+    loop.
+
+    Args:
+    hashed_password (bytes): The salted, hashed password.
+    password (str): The password to validate.
+
+    Returns:
+    bool: True if the password matches the hashed password, False otherwise.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), is_valid,
+                                      hashed_password, password)
+
+
+def hash_passwords(passwords: Iterable[str]) -> List[bytes]:
+    """
+    Hash several passwords concurrently on the bcrypt worker pool.
+
+    Args:
+    passwords (Iterable[str]): The passwords to hash.
+
+    Returns:
+    List[bytes]: The hashed passwords, in the order of the input.
+    """
+    return list(get_executor().map(hash_password, passwords))
+
+
+def validate_passwords(pairs: Iterable[Tuple[bytes, str]]) -> List[bool]:
+    """
+    Validate several passwords concurrently on the bcrypt worker pool.
+
+    Args:
+    pairs (Iterable[Tuple[bytes, str]]): The (hashed password, password)
+        pairs to validate.
+
+    Returns:
+    List[bool]: Whether each password matches its hash, in input order.
+    """
+    return list(get_executor().map(_is_valid_pair, pairs))
+
+
+def bulk_hash_passwords(passwords: Iterable[str],
+                        chunksize: int = BULK_CHUNKSIZE,
+                        progress: Callable[[int], None] = None,
+                        workers: int = None) -> Iterator[bytes]:
+    """
+    Hash a large number of passwords on a pool of worker processes.
+
+    Args:
+    passwords (Iterable[str]): The passwords to hash.
+    chunksize (int): The number of passwords sent to a worker at a time.
+    progress (Callable[[int], None]): Called with the number of passwords
+        done so far, each time a result is yielded.
+    workers (int): The number of processes, one per CPU if None.
+
+    Returns:
+    Iterator[bytes]: The hashed passwords, yielded in input order as soon as
+        they are ready.
+    """
+    return _bulk(hash_password, passwords, chunksize, progress, workers)
+
+
+def bulk_validate_passwords(pairs: Iterable[Tuple[bytes, str]],
+                            chunksize: int = BULK_CHUNKSIZE,
+                            progress: Callable[[int], None] = None,
+                            workers: int = None) -> Iterator[bool]:
+    """
+    Validate a large number of passwords on a pool of worker processes.
+
+    Args:
+    pairs (Iterable[Tuple[bytes, str]]): The (hashed password, password)
+        pairs to validate.
+    chunksize (int): The number of pairs sent to a worker at a time.
+    progress (Callable[[int], None]): Called with the number of pairs done
+        so far, each time a result is yielded.
+    workers (int): The number of processes, one per CPU if None.
+
+    Returns:
+    Iterator[bool]: Whether each password matches its hash, yielded in input
+        order as soon as they are ready.
+    """
+    return _bulk(_is_valid_pair, pairs, chunksize, progress, workers)
+
+
+def _is_valid_pair(pair: Tuple[bytes, str]) -> bool:
+    """
+    Validate a (hashed password, password) pair; picklable for the process
+    pool.
+
+    Args:
+    pair (Tuple[bytes, str]): The hashed password and the password.
+
+    Returns:
+    bool: True if the password matches the hashed password, False otherwise.
+    """
+    return is_valid(*pair)
+
+
+def _bulk(func: Callable, items: Iterable, chunksize: int,
+          progress: Callable[[int], None], workers: int) -> Iterator:
+    """
+    Map a function over items on a process pool, streaming ordered results.
+
+    Workers start with the hashing settings and hashers of this process, so
+    results do not depend on the multiprocessing start method. Items are
+    read and sent in chunks, with at most two chunks per worker in flight,
+    so neither the input nor the results are held in memory at once.
+
+    Args:
+    func (Callable): The module level function applied to each item.
+    items (Iterable): The items to process.
+    chunksize (int): The number of items sent to a worker at a time.
+    progress (Callable[[int], None]): Called with the number of results
+        yielded so far, or None.
+    workers (int): The number of processes, one per CPU if None.
+
+    Returns:
+    Iterator: The results, in input order.
+    """
+    workers = workers or os.cpu_count() or 1
+    items = iter(items)
+    chunks = iter(lambda: list(islice(items, chunksize)), [])
+    done = 0
+    with ProcessPoolExecutor(workers, initializer=_configure,
+                             initargs=(_settings(),)) as pool:
+        pending = deque()
+        while True:
+            for chunk in islice(chunks, 2 * workers - len(pending)):
+                pending.append(pool.submit(_map_chunk, func, chunk))
+            if not pending:
+                return
+            for result in pending.popleft().result():
+                done += 1
+                if progress is not None:
+                    progress(done)
+                yield result
+
+
+def _map_chunk(func: Callable, chunk: List) -> List:
+    """
+    Apply a function to a chunk of items in a worker process.
+
+    Args:
+    func (Callable): The module level function applied to each item.
+    chunk (List): The items.
+
+    Returns:
+    List: The results, in order.
+    """
+    return [func(item) for item in chunk]
+
+
+def _settings() -> Dict[str, object]:
+    """
+    Capture the hashing settings and hashers of this process.
+
+    Returns:
+    Dict[str, object]: The module globals to set in a worker process.
+    """
+    return {
+        'BCRYPT_ROUNDS': BCRYPT_ROUNDS,
+        'PASSWORD_HASHER': PASSWORD_HASHER,
+        'SCRYPT_LN': SCRYPT_LN,
+        'SCRYPT_R': SCRYPT_R,
+        'SCRYPT_P': SCRYPT_P,
+        'HASHERS': dict(HASHERS),
+    }
+
+
+def _configure(settings: Dict[str, object]) -> None:
+    """
+    Apply the settings captured by _settings, in a worker process.
+
+    Args:
+    settings (Dict[str, object]): The module globals to set.
+    """
+    globals().update(settings)
+
+
+if __name__ == "__main__":
+    print(calibrate_rounds())
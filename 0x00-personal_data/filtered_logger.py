@@ -4,10 +4,26 @@
 """
 
 import re
+import csv
+import copy
+import mmap
+import sys
+import atexit
 import logging
+import logging.handlers
 import mysql.connector
+import mysql.connector.pooling
 import os
-from typing import List
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import (Collection, Dict, IO, Iterator, List, Pattern, Sequence,
+                    Tuple)
 
 
 """
@@ -19,6 +35,55 @@ from typing import List
 """
 PII_FIELDS = ('name', 'email', 'phone', 'ssn', 'password')
 
+# Value detectors: a guard pattern any match must contain, used to skip lines
+# that cannot match, and the pattern of the value. Guards start with a literal
+# character, which the regex engine looks for without trying every position.
+PII_DETECTORS = {
+    'email': ('@', r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+'),
+    'ssn': (r'-\d\d-\d{4}', r'\b\d{3}-\d{2}-\d{4}\b'),
+    'phone': (r'-\d{4}\b',
+              r'(?:\(\d{3}\)\s?|\b\d{3}[-.])\d{3}-\d{4}\b'),
+    'ipv6': (r'::|:[0-9A-Fa-f]{1,4}:[0-9A-Fa-f]{1,4}:',
+             r'\b(?:[0-9A-Fa-f]{1,4}:){7}[0-9A-Fa-f]{1,4}\b'
+             r'|\b(?:[0-9A-Fa-f]{1,4}:){1,6}'
+             r'(?::[0-9A-Fa-f]{1,4}){1,6}\b'),
+    'ipv4': (r'\.\d{1,3}\.\d',
+             r'\b(?:(?:25[0-5]|2[0-4]\d|1?\d?\d)\.){3}'
+             r'(?:25[0-5]|2[0-4]\d|1?\d?\d)\b'),
+}
+
+# Number of rows pulled from the server per round trip when exporting
+BATCH_SIZE = 1000
+# Maximum number of records waiting for the listener thread of a queued logger
+QUEUE_SIZE = 10000
+# Name and default size of the connection pool used by get_db(pooled=True)
+POOL_NAME = "personal_data"
+POOL_SIZE = 5
+# Seconds get_db(pooled=True) waits for a free connection, and delay between
+# two attempts
+POOL_TIMEOUT = 10.0
+POOL_RETRY_DELAY = 0.01
+# Buffer size of the output file written by csv_main
+WRITE_BUFFER_SIZE = 1 << 20
+
+_pool = None
+_pool_lock = threading.Lock()
+# Arguments, handler and listener of the last get_logger setup
+_logger_setup = None
+_logger_lock = threading.Lock()
+
+
+class _RedactedMessage(str):
+    """
+    Log message already redacted by this module, which RedactingFormatter
+    formats as is.
+
+    Only this module creates such messages, so a caller cannot make a
+    formatter skip the redaction of its records.
+    """
+
+    __slots__ = ()
+
 
 class RedactingFormatter(logging.Formatter):
     """
@@ -29,21 +94,119 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], strategy: str = 'regex',
+                 detectors: Sequence[str] = ()):
         """
         Initialize RedactingFormatter with a list of fields to redact.
 
         Args:
         - fields (List[str]): A list of strings representing fields to redact.
+        - strategy (str): How string messages are redacted: 'regex' with
+            the pattern of filter_datum, or 'trie' with a KeywordScanner,
+            faster for large sets of fields. Both redact the same values.
+        - detectors (Sequence[str]): Names of PII_DETECTORS whose values are
+            also redacted wherever they appear in the message.
         """
+        if strategy not in ('regex', 'trie'):
+            raise ValueError(f"Unknown redaction strategy: {strategy}")
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.strategy = strategy
+        self.detectors = tuple(detectors)
+        self._memo_key = (type(self), self._fmt, self.datefmt, tuple(fields),
+                          self.REDACTION, self.SEPARATOR, strategy,
+                          self.detectors)
+        self._scanner = None
+        if strategy == 'trie':
+            self._scanner = KeywordScanner(fields, self.SEPARATOR)
+        self._field_set = frozenset(fields)
+        self._pattern = self.pattern_for(fields)
+        self._suffix = f'={self.REDACTION}{self.SEPARATOR}'
+
+    @classmethod
+    def pattern_for(cls, fields: List[str]) -> Pattern:
+        """
+        Return the compiled redaction pattern shared by every formatter
+        redacting the same fields.
+
+        Args:
+        - fields (List[str]): A list of strings representing fields to redact.
+
+        Returns:
+        Pattern: The cached pattern, or None when there is nothing to redact.
+        """
+        if not fields:
+            return None
+        return _redaction_pattern(tuple(fields), cls.SEPARATOR)
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        """
+        Format the message part of the log record.
+
+        When detectors are enabled, PII values are redacted from the message
+        itself, before it is merged with the rest of the log line. The
+        fields are redacted by key first, so the detectors only scan the
+        values left in clear.
+
+        Args:
+        record (logging.LogRecord): The log record to be formatted.
+
+        Returns:
+        str: The log line.
+        """
+        if self.detectors and not isinstance(record.msg, _RedactedMessage):
+            record.message = filter_values(self.detectors, self.REDACTION,
+                                           self._redact_fields(
+                                               record.message))
+        return super(RedactingFormatter, self).formatMessage(record)
+
+    def _redact_fields(self, text: str) -> str:
+        """
+        Redact the values of the fields in a text, with the strategy of the
+        formatter.
+
+        Args:
+        text (str): The text to redact.
+
+        Returns:
+        str: The text with the values of the fields obfuscated.
+        """
+        if self._pattern is None:
+            return text
+        if self._scanner is not None:
+            return self._scanner.redact(text, self.REDACTION)
+        return self._pattern.sub(lambda m: m.group(1) + self._suffix, text)
 
     def format(self, record: logging.LogRecord) -> str:
         """
-        Format the log record.
+        Format the log record, redacting it once per formatter setup.
+
+        The redacted line is memoized on the record, so that several
+        handlers whose formatters share the same class, fields, format and
+        strategies reuse it instead of redacting the record again.
+
+        Args:
+        record (logging.LogRecord): The log record to be formatted.
+
+        Returns:
+        str: The formatted log message.
+        """
+        memo = getattr(record, 'redaction_memo', None)
+        if memo is not None and memo[0] == self._memo_key:
+            return memo[1]
+        message = self._format(record)
+        record.redaction_memo = (self._memo_key, message)
+        return message
+
+    def _format(self, record: logging.LogRecord) -> str:
+        """
+        Format and redact the log record.
 
-        This method redacts specified fields in the log message.
+        This method redacts specified fields in the log message. When the
+        record message is a row dict, the values are redacted by key and the
+        row is rendered once, without going through the regex. Messages
+        redacted beforehand by this module, e.g. by export_users, are
+        formatted as is.
 
         Args:
         record (logging.LogRecord): The log record to be formatted.
@@ -51,9 +214,94 @@ class RedactingFormatter(logging.Formatter):
         Returns:
         str: The formatted log message.
         """
-        return filter_datum(self.fields, self.REDACTION,
-                            super(RedactingFormatter, self).format(record),
-                            self.SEPARATOR)
+        if isinstance(record.msg, dict):
+            row = copy.copy(record)
+            row.msg = filter_row(self._field_set, self.REDACTION, record.msg,
+                                 self.SEPARATOR)
+            row.args = None
+            return super(RedactingFormatter, self).format(row)
+        message = super(RedactingFormatter, self).format(record)
+        if isinstance(record.msg, _RedactedMessage):
+            return message
+        if self.detectors and not record.exc_text and not record.stack_info:
+            # formatMessage already redacted the fields of the message
+            return message
+        return self._redact_fields(message)
+
+
+class KeywordScanner:
+    """
+    Redaction scanner whose cost does not depend on the number of fields.
+
+    Every field name is stored reversed in a trie. Since a match always ends
+    with "=", the scanner jumps from one "=" to the next and walks the trie
+    backwards from there to find the longest field name ending at it. A
+    message is thus scanned once, in time linear in its length, whether
+    there are five fields or hundreds. Matches are the same as the ones of
+    filter_datum.
+    """
+
+    def __init__(self, fields: List[str], separator: str):
+        """
+        Initialize KeywordScanner with the fields to redact.
+
+        Args:
+        - fields (List[str]): A list of strings representing fields to redact.
+        - separator (str): A string representing by which character is
+            separating all fields in the log line.
+        """
+        self.fields = fields
+        self.separator = separator
+        self._trie = {}
+        for field in fields:
+            node = self._trie
+            for char in reversed(field):
+                node = node.setdefault(char, {})
+            node[None] = True
+
+    def redact(self, message: str, redaction: str) -> str:
+        """
+        Obfuscate the values of the fields in a log message.
+
+        Args:
+        - message (str): A string representing the log line.
+        - redaction (str): A string representing by what the field will be
+            obfuscated.
+
+        Returns:
+        str: The log message with the values of the fields obfuscated.
+        """
+        separator = self.separator
+        pieces = []
+        last = floor = 0
+        equal = message.find('=')
+        while equal != -1:
+            start = -1
+            node = self._trie
+            if None in node:
+                start = equal
+            position = equal - 1
+            while position >= floor:
+                node = node.get(message[position])
+                if node is None:
+                    break
+                if None in node:
+                    start = position
+                position -= 1
+            if start != -1:
+                end = message.find(separator, equal + 2)
+                if end != -1 and message.find('\n', equal + 1, end) == -1:
+                    pieces.append(message[last:equal + 1])
+                    pieces.append(redaction)
+                    last = end
+                    floor = end + len(separator)
+                    equal = message.find('=', floor)
+                    continue
+            equal = message.find('=', equal + 1)
+        if not pieces:
+            return message
+        pieces.append(message[last:])
+        return ''.join(pieces)
 
 
 def filter_datum(fields: List[str],
@@ -72,76 +320,879 @@ def filter_datum(fields: List[str],
     Returns:
     - A string representing the log message with specified fields obfuscated.
     """
-    for field in fields:
-        message = re.sub(fr'{re.escape(field)}=.+?{re.escape(separator)}',
-                         f'{field}={redaction}{separator}', message)
-    return message
+    if not fields:
+        return message
+    pattern = _redaction_pattern(tuple(fields), separator)
+    return pattern.sub(lambda m: f'{m.group(1)}={redaction}{separator}',
+                       message)
+
+
+def filter_row(fields: Collection[str], redaction: str,
+               row: Dict[str, object], separator: str) -> str:
+    """
+    - Renders a structured row as a log line, obfuscating specified fields
+        by key.
+
+    Arguments:
+        - fields: A collection of strings representing the fields to
+                obfuscate.
+        - redaction: A string representing by what the field will be
+                obfuscated.
+        - row: A dict mapping each column name to its value.
+        - separator: A string representing by which character is separating
+                all fields in the log line.
+
+    Returns:
+    - A string representing the log line with specified fields obfuscated.
+    """
+    return ' '.join(f'{key}={redaction if key in fields else value}'
+                    f'{separator}' for key, value in row.items())
+
+
+def filter_columns(fields: Collection[str], redaction: str,
+                   columns: Dict[str, Sequence], separator: str) -> List[str]:
+    """
+    - Renders a column-oriented batch of rows as log lines, obfuscating
+        specified fields by column.
+
+    The obfuscated columns are never read: they are baked into the line
+    template once, and the remaining columns are zipped into it row by row.
+
+    Arguments:
+        - fields: A collection of strings representing the fields to
+                obfuscate.
+        - redaction: A string representing by what the field will be
+                obfuscated.
+        - columns: A dict mapping each column name to the sequence of its
+                values (a list, tuple or any array supporting len()).
+        - separator: A string representing by which character is separating
+                all fields in the log line.
+
+    Returns:
+    - A list of strings representing the log lines, one per row.
+    """
+    names = list(columns)
+    template, keep = _line_template(names, fields, redaction, separator)
+    if not keep:
+        size = len(columns[names[0]]) if names else 0
+        return [template] * size
+    return [template.format(*values)
+            for values in zip(*(columns[names[i]] for i in keep))]
+
+
+def _line_template(names: Sequence[str], fields: Collection[str],
+                   redaction: str, separator: str) -> Tuple[str, List[int]]:
+    """
+    Build the str.format template of a log line for the given columns.
+
+    Obfuscated columns hold the redaction literally, the other columns a
+    positional placeholder.
+
+    Arguments:
+        - names: The column names, in order.
+        - fields: A collection of strings representing the fields to
+                obfuscate.
+        - redaction: A string representing by what the field will be
+                obfuscated.
+        - separator: A string representing by which character is separating
+                all fields in the log line.
+
+    Returns:
+    - The template, and the indexes of the columns it has placeholders for.
+    """
+    def escape(text: str) -> str:
+        """Escape the braces of a literal part of the template."""
+        return text.replace('{', '{{').replace('}', '}}')
+
+    keep = [i for i, name in enumerate(names) if name not in fields]
+    template = ' '.join(
+        escape(name) + '=' +
+        ('{}' if name not in fields else escape(redaction)) +
+        escape(separator)
+        for name in names)
+    return template, keep
+
+
+def filter_values(detectors: Sequence[str], redaction: str,
+                  message: str) -> str:
+    """
+    - Obfuscates PII values found anywhere in a log message.
+
+    Only the detectors whose guard pattern is found in the message are
+    combined into the pattern. Guards are short patterns, mostly literal,
+    so lines that cannot contain a value skip the detectors cheaply.
+
+    Arguments:
+        - detectors: Names of PII_DETECTORS to look for.
+        - redaction: A string representing by what the values will be
+                obfuscated.
+        - message: A string representing the log line.
+
+    Returns:
+    - A string representing the log message with PII values obfuscated.
+    """
+    present = tuple(name for name in detectors
+                    if _guard_pattern(name).search(message))
+    if not present:
+        return message
+    return _detector_pattern(present).sub(redaction.replace('\\', r'\\'),
+                                          message)
+
+
+@lru_cache(maxsize=None)
+def _guard_pattern(detector: str) -> Pattern:
+    """
+    Compile the guard pattern of a detector.
+
+    Arguments:
+        - detector: The name of a PII_DETECTORS entry.
+
+    Returns:
+    - The compiled guard, cached per detector.
+    """
+    return re.compile(PII_DETECTORS[detector][0])
+
+
+@lru_cache(maxsize=None)
+def _detector_pattern(detectors: Tuple[str, ...]) -> Pattern:
+    """
+    Compile the detectors into a single alternation pattern.
+
+    Arguments:
+        - detectors: Names of PII_DETECTORS to combine.
+
+    Returns:
+    - The compiled pattern, cached per tuple of detectors.
+    """
+    return re.compile('|'.join(f'(?:{PII_DETECTORS[name][1]})'
+                               for name in detectors))
 
 
-def get_logger() -> logging.Logger:
+@lru_cache(maxsize=None)
+def _redaction_pattern(fields: Tuple[str, ...], separator: str) -> Pattern:
+    """
+    Compile a single regex matching any of the fields to obfuscate.
+
+    All fields are folded into one alternation so that a message is scanned
+    once, whatever the number of fields. The compiled pattern is cached per
+    (fields, separator) pair.
+
+    Arguments:
+        - fields: A tuple of strings representing the fields to obfuscate.
+        - separator: A string representing by which character is separating
+                all fields in the log line.
+
+    Returns:
+    - The compiled pattern, with the matched field name as group 1.
+    """
+    alternation = '|'.join(re.escape(field) for field in fields)
+    return re.compile(fr'({alternation})=.+?{re.escape(separator)}')
+
+
+class BlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that hands records over untouched and waits for room in
+    the queue instead of dropping records when it is full.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Return the record as is, so that formatting and redaction happen on
+        the listener thread rather than on the producer.
+
+        Args:
+        record (logging.LogRecord): The log record to be enqueued.
+
+        Returns:
+        logging.LogRecord: The same log record.
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        Put the record on the queue, blocking while the queue is full.
+
+        Args:
+        record (logging.LogRecord): The log record to be enqueued.
+        """
+        self.queue.put(record)
+
+
+class BlockingQueueListener(logging.handlers.QueueListener):
+    """
+    Queue listener whose stop sentinel waits for room in a bounded queue.
+    """
+
+    def enqueue_sentinel(self) -> None:
+        """
+        Put the stop sentinel on the queue, blocking while the queue is full.
+        """
+        self.queue.put(self._sentinel)
+
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """
+    Stream handler that accumulates formatted records and writes them in
+    large chunks.
+
+    The buffer is written when it reaches capacity characters, every
+    interval seconds, on records of flush_level or above, and when the
+    handler is flushed or closed (logging.shutdown does both at exit).
+    """
+
+    def __init__(self, stream: IO[str] = None, capacity: int = 1 << 16,
+                 interval: float = 1.0, flush_level: int = logging.ERROR):
+        """
+        Initialize BufferedStreamHandler.
+
+        Args:
+        - stream (IO[str]): The stream to write to, sys.stderr if None.
+        - capacity (int): The number of buffered characters triggering a
+            write.
+        - interval (float): The maximum number of seconds a record stays in
+            the buffer; no timed flush when 0.
+        - flush_level (int): The level from which a record is written at
+            once, along with the records buffered before it.
+        """
+        super(BufferedStreamHandler, self).__init__(stream)
+        self.capacity = capacity
+        self.interval = interval
+        self.flush_level = flush_level
+        self._buffer = []
+        self._size = 0
+        # Not _closed, which logging.Handler uses for a flag of its own
+        self._stop_event = threading.Event()
+        if interval:
+            threading.Thread(target=self._flush_periodically,
+                             daemon=True).start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        Format the record into the buffer, writing the buffer when full or
+        when the record is severe enough.
+
+        Args:
+        record (logging.LogRecord): The log record to be emitted.
+        """
+        try:
+            line = self.format(record) + self.terminator
+            self._buffer.append(line)
+            self._size += len(line)
+            if self._size >= self.capacity or \
+                    record.levelno >= self.flush_level:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        """
+        Write the buffered records with a single write, then flush the
+        stream.
+
+        The buffer is emptied before the write, so records that fail to be
+        written are dropped rather than retried forever, as with
+        StreamHandler.
+        """
+        self.acquire()
+        try:
+            if self._buffer and self.stream is not None:
+                data = ''.join(self._buffer)
+                self._buffer = []
+                self._size = 0
+                self.stream.write(data)
+            super(BufferedStreamHandler, self).flush()
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        """
+        Stop the timed flushes and write what is left in the buffer.
+
+        Closing the handler again, as logging.shutdown does at exit, does
+        nothing more.
+        """
+        if not self._stop_event.is_set():
+            self._stop_event.set()
+            self.flush()
+        super(BufferedStreamHandler, self).close()
+
+    def _flush_periodically(self) -> None:
+        """
+        Flush the buffer every interval seconds until the handler is closed.
+        """
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                if logging.raiseExceptions:
+                    traceback.print_exc()
+
+
+def get_logger(queued: bool = False, queue_size: int = QUEUE_SIZE,
+               sink: logging.Handler = None) -> logging.Logger:
     """
     - Create a get_logger function that takes no arguments and returns a
         logging.Logger object.
     - The logger should be named "user_data" and only log up to logging.INFO
         level. It should not propagate messages to other loggers. It should
         have a StreamHandler with RedactingFormatter as formatter..
+    - When queued is True, the StreamHandler runs behind a bounded queue on a
+        QueueListener thread, so producers only pay for an enqueue.
+    - sink replaces the StreamHandler, e.g. with a BufferedStreamHandler,
+        a FileHandler, a RotatingFileHandler or a MemoryHandler (whose
+        target gets the formatter).
+    - Calling it again with the same arguments returns the logger as is.
+        Other arguments replace, and close, the handler it installed before,
+        so records are never written twice. A sink passed again is
+        re-attached without being closed.
     """
+    global _logger_setup
     logger = logging.getLogger("user_data")
-    logger.setLevel(logging.INFO)
-    logger.propagate = False
-    stream = logging.StreamHandler()
-    formatter = RedactingFormatter(list(PII_FIELDS))
-    stream.setFormatter(formatter)
-    logger.addHandler(stream)
+    key = (queued, queue_size, sink)
+    with _logger_lock:
+        if _logger_setup is not None and _logger_setup[0] == key:
+            return logger
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        if _logger_setup is not None:
+            _remove_handler(logger, *_logger_setup[1:], keep=sink)
+            _logger_setup = None
+
+        handler = logging.StreamHandler() if sink is None else sink
+        formatter = RedactingFormatter(list(PII_FIELDS))
+        if isinstance(handler, logging.handlers.MemoryHandler) and \
+                handler.target is not None:
+            handler.target.setFormatter(formatter)
+        else:
+            handler.setFormatter(formatter)
+        listener = None
+        if queued:
+            records = queue.Queue(queue_size)
+            listener = BlockingQueueListener(records, handler)
+            listener.start()
+            atexit.register(listener.stop)
+            handler = BlockingQueueHandler(records)
+        logger.addHandler(handler)
+        _logger_setup = (key, handler, listener)
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
+def _remove_handler(logger: logging.Logger, handler: logging.Handler,
+                    listener: logging.handlers.QueueListener,
+                    keep: logging.Handler = None) -> None:
+    """
+    Detach and close a handler installed by get_logger.
+
+    Args:
+    - logger (logging.Logger): The logger the handler is attached to.
+    - handler (logging.Handler): The handler to remove.
+    - listener (logging.handlers.QueueListener): The listener feeding the
+        actual handlers when the handler is a queue handler, or None.
+    - keep (logging.Handler): A handler about to be installed again, which
+        is detached but left open.
+    """
+    logger.removeHandler(handler)
+    if listener is not None:
+        listener.stop()
+        atexit.unregister(listener.stop)
+        for target in listener.handlers:
+            if target is not keep:
+                target.close()
+    if handler is not keep:
+        handler.close()
+
+
+def _db_config() -> Dict[str, str]:
+    """
+    Read the database credentials from environment variables.
+
+    Returns:
+    - Dict[str, str]: The keyword arguments for mysql.connector.connect.
+    """
+    return {
+        'user': os.getenv('PERSONAL_DATA_DB_USERNAME', 'root'),
+        'password': os.getenv('PERSONAL_DATA_DB_PASSWORD', ''),
+        'host': os.getenv('PERSONAL_DATA_DB_HOST', 'localhost'),
+        'database': os.getenv('PERSONAL_DATA_DB_NAME'),
+    }
+
+
+def get_db_pool(size: int = None) -> \
+        mysql.connector.pooling.MySQLConnectionPool:
+    """
+    Return the process wide connection pool, creating it on first use.
+
+    Concurrent first calls create a single pool.
+
+    Args:
+    - size (int): The number of connections kept in the pool. Defaults to
+        PERSONAL_DATA_DB_POOL_SIZE, or POOL_SIZE when it is not set. Only
+        used when the pool is created.
+
+    Returns:
+    - mysql.connector.pooling.MySQLConnectionPool: The connection pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if size is None:
+                size = int(os.getenv('PERSONAL_DATA_DB_POOL_SIZE',
+                                     POOL_SIZE))
+            _pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name=POOL_NAME,
+                pool_size=size,
+                pool_reset_session=True,
+                **_db_config()
+            )
+        return _pool
+
+
+def set_db_pool(pool) -> None:
+    """
+    Install the pool get_db(pooled=True) borrows connections from.
+
+    Any object whose get_connection method raises
+    mysql.connector.errors.PoolError when no connection is free will do,
+    e.g. a pool with other settings, or a stand-in serving test connections
+    (see pool-main.py).
+
+    Args:
+    - pool: The pool, or None to create the default one on next use.
+    """
+    global _pool
+    with _pool_lock:
+        _pool = pool
+
+
+def get_db(pooled: bool = False, timeout: float = POOL_TIMEOUT) -> \
+        mysql.connector.connection.MySQLConnection:
     """
     Connect to the MySQL database using credentials from environment variables.
 
+    Args:
+    - pooled (bool): Borrow the connection from the pool returned by
+        get_db_pool instead of opening a new one. The pool reconnects a
+        connection found dead when handing it out. Closing it returns it to
+        the pool.
+    - timeout (float): The number of seconds to wait for a connection to be
+        returned when every pooled connection is in use.
+
     Returns:
     - mysql.connector.connection.MySQLConnection: A connection to the MySQL
         database.
     """
-    # Get database credentials from environment variables
-    username = os.getenv('PERSONAL_DATA_DB_USERNAME', 'root')
-    password = os.getenv('PERSONAL_DATA_DB_PASSWORD', '')
-    host = os.getenv('PERSONAL_DATA_DB_HOST', 'localhost')
-    dbname = os.getenv('PERSONAL_DATA_DB_NAME')
-
     # Connect to the database
     try:
-        connection = mysql.connector.connect(
-            user=username,
-            password=password,
-            host=host,
-            database=dbname
-        )
-        return connection
+        if pooled:
+            return _borrow_connection(get_db_pool(), timeout)
+        return mysql.connector.connect(**_db_config())
     except mysql.connector.Error as e:
         print(f"Error connecting to the database: {e}")
         return None
 
 
-def main():
+def _borrow_connection(pool, timeout: float):
     """
-    Main function
+    Get a connection from a pool, waiting while the pool is exhausted.
+
+    Args:
+    - pool: The pool to get the connection from.
+    - timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+    - The pooled connection.
+
+    Raises:
+    - mysql.connector.errors.PoolError: If no connection was returned to the
+        pool in time.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return pool.get_connection()
+        except mysql.connector.errors.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(POOL_RETRY_DELAY)
+
+
+def stream_rows(cursor, batch_size: int = BATCH_SIZE) -> Iterator[tuple]:
+    """
+    Yield the rows of an executed query, fetching them in batches.
+
+    With an unbuffered cursor only one batch is held in client memory at a
+    time, however large the result set is.
+
+    Args:
+    - cursor: A cursor on which a query has been executed.
+    - batch_size (int): The number of rows fetched per call to fetchmany.
+
+    Returns:
+    - Iterator[tuple]: The rows of the result set, in order.
+    """
+    for rows in stream_batches(cursor, batch_size):
+        yield from rows
+
+
+def stream_batches(cursor,
+                   batch_size: int = BATCH_SIZE) -> Iterator[List[tuple]]:
+    """
+    Yield the rows of an executed query, one fetchmany batch at a time.
+
+    Args:
+    - cursor: A cursor on which a query has been executed.
+    - batch_size (int): The number of rows fetched per call to fetchmany.
+
+    Returns:
+    - Iterator[List[tuple]]: The non-empty batches of rows, in order.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def export_users(cursor, logger: logging.Logger,
+                 batch_size: int = BATCH_SIZE, columnar: bool = False) -> None:
+    """
+    Log every row of the users table as a structured record.
+
+    Args:
+    - cursor: An unbuffered cursor on the personal data database.
+    - logger (logging.Logger): The logger the rows are written to.
+    - batch_size (int): The number of rows fetched per call to fetchmany.
+    - columnar (bool): Redact and render each batch at once with
+        filter_columns, and log the lines as already redacted.
     """
-    db = get_db()
-    cursor = db.cursor()
     cursor.execute("SELECT * FROM users;")
     field_names = [i[0] for i in cursor.description]
+    if not columnar:
+        for row in stream_rows(cursor, batch_size):
+            logger.info(dict(zip(field_names, row)))
+        return
+    for rows in stream_batches(cursor, batch_size):
+        columns = dict(zip(field_names, zip(*rows)))
+        for message in filter_columns(PII_FIELDS,
+                                      RedactingFormatter.REDACTION, columns,
+                                      RedactingFormatter.SEPARATOR):
+            logger.info(_RedactedMessage(message))
+
+
+def _primary_key(cursor) -> List[str]:
+    """
+    Read the primary key columns of the users table.
+
+    Args:
+    - cursor: A cursor on the personal data database.
+
+    Returns:
+    - List[str]: The key columns in index order, empty without a primary key.
+    """
+    cursor.execute("SHOW KEYS FROM users WHERE Key_name = 'PRIMARY';")
+    return [row[4] for row in sorted(cursor.fetchall(), key=lambda r: r[3])]
+
+
+def _key_windows(cursor, key: Sequence[str],
+                 batch_size: int) -> Iterator[Tuple[tuple, tuple, tuple]]:
+    """
+    Split the users table into primary key ranges of batch_size rows.
+
+    Only the key columns are read, in key order, through the index.
+
+    Args:
+    - cursor: An unbuffered cursor on the personal data database.
+    - key (Sequence[str]): The primary key columns.
+    - batch_size (int): The number of rows in each range.
+
+    Returns:
+    - Iterator[Tuple[tuple, tuple, tuple]]: The key columns, the exclusive
+        lower bound (None for the first range) and the inclusive upper bound
+        of each range, in key order.
+    """
+    columns = ', '.join(f'`{name}`' for name in key)
+    cursor.execute(f"SELECT {columns} FROM users ORDER BY {columns};")
+    lower = None
+    for keys in stream_batches(cursor, batch_size):
+        upper = tuple(keys[-1])
+        yield tuple(key), lower, upper
+        lower = upper
+
+
+def _window_query(key: Sequence[str], lower: tuple,
+                  upper: tuple) -> Tuple[str, tuple]:
+    """
+    Build the query reading one primary key range of the users table.
+
+    Args:
+    - key (Sequence[str]): The primary key columns.
+    - lower (tuple): The exclusive lower bound of the range, or None.
+    - upper (tuple): The inclusive upper bound of the range.
+
+    Returns:
+    - Tuple[str, tuple]: The query, ordered by key, and its parameters.
+    """
+    columns = ', '.join(f'`{name}`' for name in key)
+    marks = ', '.join(['%s'] * len(key))
+    conditions = [f'({columns}) <= ({marks})']
+    params = tuple(upper)
+    if lower is not None:
+        conditions.insert(0, f'({columns}) > ({marks})')
+        params = tuple(lower) + params
+    return (f"SELECT * FROM users WHERE {' AND '.join(conditions)} "
+            f"ORDER BY {columns};", params)
+
+
+# Connection of a worker process of export_users_parallel
+_worker_db = None
+
+
+def _open_worker_db() -> None:
+    """
+    Open the connection of an export worker process, once per process.
+
+    Raises:
+    - RuntimeError: If the database cannot be reached.
+    """
+    global _worker_db
+    _worker_db = get_db()
+    if _worker_db is None:
+        raise RuntimeError("Cannot connect to the database")
+
+
+def _redact_window(window: Tuple[tuple, tuple, tuple]) -> List[str]:
+    """
+    Fetch and redact one primary key range of the users table.
+
+    This runs in a worker process, on the connection opened by
+    _open_worker_db.
+
+    Args:
+    - window (Tuple[tuple, tuple, tuple]): The key columns and the bounds of
+        the range, as yielded by _key_windows.
+
+    Returns:
+    - List[str]: The redacted log messages of the range, in key order.
+    """
+    cursor = _worker_db.cursor()
+    cursor.execute(*_window_query(*window))
+    field_names = [i[0] for i in cursor.description]
+    messages = _redact_rows(field_names, cursor.fetchall())
+    cursor.close()
+    return messages
+
+
+def _redact_rows(field_names: List[str], rows: List[tuple]) -> List[str]:
+    """
+    Redact rows of the users table into log messages.
+
+    Args:
+    - field_names (List[str]): The column names of the rows.
+    - rows (List[tuple]): The rows to redact.
+
+    Returns:
+    - List[str]: The redacted log messages, in order.
+    """
+    fields = frozenset(PII_FIELDS)
+    return [filter_row(fields, RedactingFormatter.REDACTION,
+                       dict(zip(field_names, row)),
+                       RedactingFormatter.SEPARATOR)
+            for row in rows]
+
+
+def _ordered_results(pool: ProcessPoolExecutor, calls: Iterator[tuple],
+                     limit: int) -> Iterator:
+    """
+    Run calls on a pool and yield their results in submission order.
+
+    At most limit calls are submitted and not yet consumed at a time, so
+    memory stays flat however many calls there are.
+
+    Args:
+    - pool (ProcessPoolExecutor): The pool running the calls.
+    - calls (Iterator[tuple]): The function and arguments of each call.
+    - limit (int): The maximum number of calls in flight.
+
+    Returns:
+    - Iterator: The result of each call.
+    """
+    pending = deque()
+    for call in calls:
+        pending.append(pool.submit(*call))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def export_users_parallel(logger: logging.Logger, workers: int = None,
+                          batch_size: int = BATCH_SIZE) -> None:
+    """
+    Log every row of the users table, redacting it in a pool of processes.
+
+    When the table has a primary key, it is split into key ranges of
+    batch_size rows. Each range is read, in key order, and redacted by a
+    worker process on a connection of its own, and the ranges are logged in
+    key order.
+
+    Without a primary key there is no stable way to split the table: this
+    process reads it with the single query of export_users, so the output
+    has the same rows in the same order, and the workers only redact
+    batches of batch_size rows.
+
+    Either way, at most two batches per worker are in flight at a time.
+
+    Args:
+    - logger (logging.Logger): The logger the rows are written to.
+    - workers (int): The number of worker processes, one per CPU if None.
+    - batch_size (int): The number of rows in each batch.
+
+    Raises:
+    - RuntimeError: If the database cannot be reached.
+    """
+    workers = workers or os.cpu_count() or 1
+    db = get_db()
+    if db is None:
+        raise RuntimeError("Cannot connect to the database")
+    cursor = db.cursor(buffered=False)
+    try:
+        key = _primary_key(cursor)
+        if key:
+            initializer = _open_worker_db
+            calls = ((_redact_window, window)
+                     for window in _key_windows(cursor, key, batch_size))
+        else:
+            initializer = None
+            cursor.execute("SELECT * FROM users;")
+            field_names = [i[0] for i in cursor.description]
+            calls = ((_redact_rows, field_names, rows)
+                     for rows in stream_batches(cursor, batch_size))
+        with ProcessPoolExecutor(workers, initializer=initializer) as pool:
+            for messages in _ordered_results(pool, calls, 2 * workers):
+                for message in messages:
+                    logger.info(_RedactedMessage(message))
+    finally:
+        cursor.close()
+        db.close()
+
+
+def redact_csv(csv_path: str, output: IO[str],
+               chunk_size: int = BATCH_SIZE) -> int:
+    """
+    Write a CSV file shaped like user_data.csv as redacted log lines.
+
+    The file is memory-mapped and parsed in chunks of rows. PII columns are
+    picked by index from the header, so their values are dropped without
+    being scanned, and each chunk is written with a single write. Lines
+    have the RedactingFormatter format of the user_data logger, with one
+    timestamp per chunk.
+
+    Blank lines are skipped. Rows without as many columns as the header are
+    reported on the standard error and skipped.
+
+    Args:
+    - csv_path (str): The path of the CSV file, with a header row.
+    - output (IO[str]): The text stream the redacted lines are written to.
+    - chunk_size (int): The number of rows rendered per write.
+
+    Returns:
+    - int: The number of rows written.
+    """
+    count = 0
+    prefix = logging.Formatter(RedactingFormatter.FORMAT)
+    with open(csv_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return count
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            reader = csv.reader(line.decode()
+                                for line in iter(data.readline, b''))
+            header = next(reader)
+            template, keep = _line_template(header, PII_FIELDS,
+                                            RedactingFormatter.REDACTION,
+                                            RedactingFormatter.SEPARATOR)
+            template += '\n'
+            rows = _csv_rows(reader, len(header), csv_path)
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                line = prefix.format(logging.makeLogRecord({
+                    'name': 'user_data', 'levelno': logging.INFO,
+                    'levelname': 'INFO'}))
+                line = line.replace('{', '{{').replace('}', '}}') + template
+                output.write(''.join(line.format(*[row[i] for i in keep])
+                                     for row in chunk))
+                count += len(chunk)
+    return count
+
+
+def _csv_rows(reader: Iterator[List[str]], width: int,
+              csv_path: str) -> Iterator[List[str]]:
+    """
+    Yield the rows of a CSV reader that have the expected number of columns.
+
+    Blank lines are skipped silently, other malformed rows are reported on
+    the standard error.
+
+    Args:
+    - reader (Iterator[List[str]]): The csv.reader of the file.
+    - width (int): The number of columns of the header.
+    - csv_path (str): The path of the file, for the reports.
+
+    Returns:
+    - Iterator[List[str]]: The well-formed rows, in order.
+    """
+    for row in reader:
+        if len(row) == width:
+            yield row
+        elif row:
+            print(f"{csv_path}:{reader.line_num}: expected {width} columns, "
+                  f"got {len(row)}, row skipped", file=sys.stderr)
+
+
+def csv_main(argv: Sequence[str]) -> None:
+    """
+    Redact a CSV file from the command line.
+
+    Usage: filtered_logger.py <csv_path> [output_path]
+
+    The redacted lines go to output_path, or to the standard output when it
+    is not given.
+
+    Args:
+    - argv (Sequence[str]): The command line arguments, without the program.
+    """
+    if len(argv) > 1:
+        with open(argv[1], 'w', buffering=WRITE_BUFFER_SIZE) as output:
+            redact_csv(argv[0], output)
+    else:
+        redact_csv(argv[0], sys.stdout)
+
+
+def main():
+    """
+    Main function
+    """
+    batch_size = int(os.getenv('PERSONAL_DATA_BATCH_SIZE', BATCH_SIZE))
+    workers = int(os.getenv('PERSONAL_DATA_WORKERS', 1))
+    columnar = os.getenv('PERSONAL_DATA_COLUMNAR') == '1'
 
     logger = get_logger()
 
-    for row in cursor:
-        message = '; '.join(f'{field_names[i]}={str(row[i])}'
-                            for i in range(len(row)))
-        logger.info(message)
+    if workers > 1:
+        export_users_parallel(logger, workers, batch_size)
+        return
+    db = get_db()
+    cursor = db.cursor(buffered=False)
+    export_users(cursor, logger, batch_size, columnar)
     cursor.close()
     db.close()
 
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        csv_main(sys.argv[1:])
+    else:
+        main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Main file: pooled get_db against a stand-in pool, no MySQL server needed
+"""
+import queue
+import threading
+
+import mysql.connector
+
+filtered_logger = __import__('filtered_logger')
+
+
+class StandInConnection:
+    """ Connection going back to its pool when closed """
+
+    def __init__(self, pool: 'StandInPool', number: int):
+        self.pool = pool
+        self.number = number
+
+    def close(self) -> None:
+        self.pool.connections.put(self)
+
+
+class StandInPool:
+    """ Pool of stand-in connections, raising PoolError when exhausted """
+
+    def __init__(self, size: int):
+        self.connections = queue.Queue()
+        for number in range(size):
+            self.connections.put(StandInConnection(self, number))
+
+    def get_connection(self) -> StandInConnection:
+        try:
+            return self.connections.get(block=False)
+        except queue.Empty:
+            raise mysql.connector.errors.PoolError("pool exhausted")
+
+
+filtered_logger.set_db_pool(StandInPool(1))
+
+first = filtered_logger.get_db(pooled=True)
+print(first.number)
+threading.Timer(0.2, first.close).start()
+second = filtered_logger.get_db(pooled=True)
+print(second is first)
+print(filtered_logger.get_db(pooled=True, timeout=0.1))
+second.close()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the personal data redaction path.
+
+Measures filter_datum, RedactingFormatter.format and the export_users loop
+on generated rows shaped like user_data.csv, across field counts, message
+lengths, separators and match densities.
+
+Usage: ./redaction_benchmark.py [output_path]
+
+Results are printed and written as JSON to output_path, which defaults to
+redaction_benchmark.json.
+"""
+
+import io
+import json
+import logging
+import platform
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+from filtered_logger import (PII_FIELDS, RedactingFormatter, export_users,
+                             filter_datum)
+
+
+ROWS = 2000
+REPEAT = 5
+SEED = 42
+
+
+def generate_row(rng: random.Random, value_length: int) -> Dict[str, str]:
+    """
+    Generate one row with the columns of user_data.csv.
+
+    Args:
+    - rng (random.Random): The random generator to draw values from.
+    - value_length (int): The length of the free text user_agent value.
+
+    Returns:
+    - Dict[str, str]: The generated row.
+    """
+    digits = '0123456789'
+    return {
+        'name': f"User {rng.randrange(10 ** 6)}",
+        'email': f"user{rng.randrange(10 ** 6)}@example.com",
+        'phone': f"({rng.choice(digits) * 3}) "
+                 f"555-{rng.randrange(10 ** 4):04}",
+        'ssn': f"{rng.randrange(1000):03}-{rng.randrange(100):02}-"
+               f"{rng.randrange(10 ** 4):04}",
+        'password': ''.join(rng.choice('abcdefXYZ&?!') for _ in range(8)),
+        'ip': ':'.join(f"{rng.randrange(1 << 16):x}" for _ in range(8)),
+        'last_login': "2019-11-14 06:14:24",
+        'user_agent': ''.join(rng.choice('Mozilla/5.0 (Windows NT)')
+                              for _ in range(value_length)),
+    }
+
+
+def render(row: Dict[str, str], separator: str) -> str:
+    """
+    Render a row as the key=value log message logged by main.
+
+    Args:
+    - row (Dict[str, str]): The row to render.
+    - separator (str): The character ending each key=value pair.
+
+    Returns:
+    - str: The log message.
+    """
+    return ' '.join(f'{k}={v}{separator}' for k, v in row.items())
+
+
+def measure(func: Callable[[], None], lines: int, size: int,
+            setup: Callable[[], None] = None) -> Dict:
+    """
+    Time a function over REPEAT runs and keep the best one.
+
+    Args:
+    - func (Callable[[], None]): The function processing the whole data set.
+    - lines (int): The number of lines processed by one call.
+    - size (int): The number of bytes processed by one call.
+    - setup (Callable[[], None]): A function run, untimed, before each run.
+
+    Returns:
+    - Dict: The best time, lines per second and bytes per second.
+    """
+    best = float('inf')
+    for _ in range(REPEAT):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return {
+        'seconds': best,
+        'lines_per_sec': lines / best,
+        'bytes_per_sec': size / best,
+    }
+
+
+def bench_filter_datum(rng: random.Random) -> List[Dict]:
+    """
+    Benchmark filter_datum across field counts, message lengths, separators
+    and match densities.
+
+    The match density is the share of the redacted fields actually present
+    in the messages.
+
+    Args:
+    - rng (random.Random): The random generator to draw values from.
+
+    Returns:
+    - List[Dict]: One result per parameter combination.
+    """
+    results = []
+    for separator in (';', '|'):
+        for value_length in (16, 128, 1024):
+            rows = [generate_row(rng, value_length) for _ in range(ROWS)]
+            messages = [render(row, separator) for row in rows]
+            size = sum(len(m.encode()) for m in messages)
+            for field_count in (1, 5, 20, 100):
+                for density in (0.0, 0.5, 1.0):
+                    present = round(min(field_count, len(PII_FIELDS)) *
+                                    density)
+                    fields = list(PII_FIELDS[:present])
+                    fields += [f'absent_{i}'
+                               for i in range(field_count - present)]
+
+                    def run() -> None:
+                        """Redact every message once."""
+                        for message in messages:
+                            filter_datum(fields, 'xxx', message, separator)
+
+                    result = measure(run, len(messages), size)
+                    result.update(separator=separator,
+                                  value_length=value_length,
+                                  field_count=field_count, density=density)
+                    results.append(result)
+    return results
+
+
+def bench_formatter(rng: random.Random) -> List[Dict]:
+    """
+    Benchmark RedactingFormatter.format on string and structured records.
+
+    Args:
+    - rng (random.Random): The random generator to draw values from.
+
+    Returns:
+    - List[Dict]: One result per record kind and message length.
+    """
+    results = []
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    for value_length in (16, 128, 1024):
+        rows = [generate_row(rng, value_length) for _ in range(ROWS)]
+        for kind in ('string', 'dict'):
+            records = [
+                logging.LogRecord("user_data", logging.INFO, None, None,
+                                  render(row, ';') if kind == 'string'
+                                  else row, None, None)
+                for row in rows]
+            size = sum(len(render(row, ';').encode()) for row in rows)
+
+            def forget() -> None:
+                """Drop the lines memoized by the previous run."""
+                for record in records:
+                    record.__dict__.pop('redaction_memo', None)
+
+            def run() -> None:
+                """Format every record once."""
+                for record in records:
+                    formatter.format(record)
+
+            result = measure(run, len(records), size, forget)
+            result.update(record=kind, value_length=value_length)
+            results.append(result)
+    return results
+
+
+class ListCursor:
+    """
+    Cursor serving in-memory rows through the DB-API calls export_users uses.
+    """
+
+    def __init__(self, field_names: List[str], rows: List[tuple]):
+        """
+        Initialize a ListCursor over a fixed result set.
+
+        Args:
+        - field_names (List[str]): The column names of the result set.
+        - rows (List[tuple]): The rows of the result set.
+        """
+        self.description = [(name,) for name in field_names]
+        self._rows = rows
+        self._position = 0
+
+    def execute(self, query: str) -> None:
+        """
+        Rewind the result set; the query itself is ignored.
+
+        Args:
+        - query (str): The SQL query.
+        """
+        self._position = 0
+
+    def fetchmany(self, size: int) -> List[tuple]:
+        """
+        Return the next rows of the result set.
+
+        Args:
+        - size (int): The maximum number of rows to return.
+
+        Returns:
+        - List[tuple]: The next rows, empty once the result set is exhausted.
+        """
+        rows = self._rows[self._position:self._position + size]
+        self._position += size
+        return rows
+
+
+def bench_export(rng: random.Random) -> List[Dict]:
+    """
+    Benchmark the export_users loop, logging to an in-memory stream.
+
+    Args:
+    - rng (random.Random): The random generator to draw values from.
+
+    Returns:
+    - List[Dict]: One result per export mode.
+    """
+    results = []
+    rows = [generate_row(rng, 128) for _ in range(ROWS)]
+    field_names = list(rows[0])
+    cursor = ListCursor(field_names, [tuple(row.values()) for row in rows])
+    size = sum(len(render(row, ';').encode()) for row in rows)
+
+    logger = logging.getLogger("redaction_benchmark")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(RedactingFormatter(list(PII_FIELDS)))
+    logger.addHandler(handler)
+
+    for columnar in (False, True):
+
+        def run() -> None:
+            """Export the whole table once."""
+            handler.stream.seek(0)
+            handler.stream.truncate()
+            export_users(cursor, logger, columnar=columnar)
+
+        result = measure(run, len(rows), size)
+        result.update(columnar=columnar)
+        results.append(result)
+    logger.removeHandler(handler)
+    return results
+
+
+def main(output_path: str = "redaction_benchmark.json") -> None:
+    """
+    Run every benchmark and write the results as JSON.
+
+    Args:
+    - output_path (str): The path of the JSON results file.
+    """
+    rng = random.Random(SEED)
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'rows': ROWS,
+        'repeat': REPEAT,
+        'filter_datum': bench_filter_datum(rng),
+        'formatter': bench_formatter(rng),
+        'export_users': bench_export(rng),
+    }
+    for name in ('filter_datum', 'formatter', 'export_users'):
+        for result in results[name]:
+            params = {k: v for k, v in result.items()
+                      if k not in ('seconds', 'lines_per_sec',
+                                   'bytes_per_sec')}
+            print(f"{name} {params}: "
+                  f"{result['lines_per_sec']:,.0f} lines/s, "
+                  f"{result['bytes_per_sec'] / 1e6:,.1f} MB/s")
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
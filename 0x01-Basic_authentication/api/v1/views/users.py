@@ -2,7 +2,7 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import abort, current_app, jsonify, request
 from models.user import User
 
 
@@ -12,8 +12,9 @@ def view_all_users() -> str:
     Return:
       - list of all User objects JSON represented
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    all_users = b",".join(user.to_json_bytes() for user in User.all())
+    return current_app.response_class(b"[" + all_users + b"]\n",
+                                      mimetype="application/json")
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+""" Serializer module: JSON encoding used by models and API views
+"""
+from os import getenv
+from typing import Callable, Dict, Tuple
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(obj: object, sort_keys: bool = False) -> bytes:
+    """ Encode an object with the standard library json module
+    """
+    return json.dumps(obj, separators=(',', ':'),
+                      sort_keys=sort_keys).encode('utf-8')
+
+
+def _orjson_dumps(obj: object, sort_keys: bool = False) -> bytes:
+    """ Encode an object with orjson
+    """
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+
+# Available backends: name -> (dumps, loads), dumps returning UTF-8 bytes
+# and taking a sort_keys flag
+BACKENDS: Dict[str, Tuple[Callable, Callable]] = {
+    'json': (_json_dumps, json.loads),
+}
+if orjson is not None:
+    BACKENDS['orjson'] = (_orjson_dumps, orjson.loads)
+
+# Fastest installed backend, unless MODELS_SERIALIZER names another one
+BACKEND = getenv("MODELS_SERIALIZER", 'orjson' if orjson else 'json')
+
+
+def use(name: str):
+    """ Switch to another registered backend
+    """
+    global BACKEND
+    if name not in BACKENDS:
+        raise ValueError("Unknown serializer: {}".format(name))
+    BACKEND = name
+
+
+def dumps(obj: object, sort_keys: bool = False) -> bytes:
+    """ Encode an object to JSON as UTF-8 bytes, keys sorted if sort_keys
+    """
+    return BACKENDS[BACKEND][0](obj, sort_keys)
+
+
+def loads(data: bytes) -> object:
+    """ Decode JSON bytes or text
+    """
+    return BACKENDS[BACKEND][1](data)
@@ -1,27 +1,60 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import TypeVar, List, Iterable
-from os import path
-import json
+from os import getenv, path, remove, rename, replace
+from models import serializer
+import threading
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# Origin of the timestamps objects keep instead of datetime objects
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
 DATA = {}
+# Secondary indexes: class name -> attribute -> value -> id, or {id: None}
+# when several objects share the value
+INDEXES = {}
+# "file" rewrites .db_<Class>.json on every change, "journal" appends the
+# change to .db_<Class>.journal and folds the journal into .db_<Class>.json
+# every COMPACT_EVERY changes
+STORAGE = getenv("MODELS_STORAGE", "file")
+COMPACT_EVERY = 1000
+# "eager" builds every object when loading, "lazy" keeps the loaded records
+# in DATA as dicts and builds an object on its first get() or search() hit
+LOADING = getenv("MODELS_LOADING", "eager")
+JOURNAL_LOCK = threading.Lock()
+# One compaction at a time per class: class name -> lock
+COMPACT_LOCKS = {}
+# Changes in the journals of each class since its last snapshot
+JOURNAL_SIZES = {}
 
 
 class Base():
     """ Base class
     """
 
+    # Attributes search() looks up in a hash index instead of scanning
+    INDEXED_ATTRIBUTES = ()
+
+    # No per-instance __dict__: subclasses list their attributes in
+    # __slots__ too. created_at and updated_at are kept as microseconds since
+    # EPOCH, lighter than datetime objects, and _indexed holds the values the
+    # object is indexed under: the value itself for a single indexed
+    # attribute, a tuple otherwise
+    __slots__ = ('id', '_created_at', '_updated_at', '_indexed')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+        if INDEXES.get(s_class) is None:
+            INDEXES[s_class] = {k: {} for k in self.INDEXED_ATTRIBUTES}
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
@@ -44,11 +77,35 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @property
+    def created_at(self) -> datetime:
+        """ Creation time, as a naive UTC datetime
+        """
+        return EPOCH + timedelta(microseconds=self._created_at)
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Setter of the creation time
+        """
+        self._created_at = (value - EPOCH) // MICROSECOND
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Last update time, as a naive UTC datetime
+        """
+        return EPOCH + timedelta(microseconds=self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Setter of the last update time
+        """
+        self._updated_at = (value - EPOCH) // MICROSECOND
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self._attributes():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -57,49 +114,232 @@ class Base():
                 result[key] = value
         return result
 
+    def to_json_bytes(self) -> bytes:
+        """ Return to_json() encoded as JSON, keys sorted as jsonify does
+        """
+        return serializer.dumps(self.to_json(), sort_keys=True)
+
+    def _attributes(self) -> Iterable[tuple]:
+        """ Return the (name, value) pairs of the object attributes, slots
+        first, in definition order
+        """
+        pairs = [('id', self.id), ('created_at', self.created_at),
+                 ('updated_at', self.updated_at)]
+        pairs.extend((k, getattr(self, k)) for k in _slot_names(self.__class__)
+                     if k not in Base.__slots__ and hasattr(self, k))
+        if hasattr(self, '__dict__'):
+            pairs.extend(self.__dict__.items())
+        return pairs
+
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from file, then replay the journal
+
+        Lines that do not parse, left by a crash in the middle of an append,
+        are skipped. The objects are then saved at once, which drops the
+        damaged journals.
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
+        journal_path = ".db_{}.journal".format(s_class)
         DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        INDEXES[s_class] = {k: {} for k in cls.INDEXED_ATTRIBUTES}
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        build = cls if LOADING == "eager" else dict
+        changes = 0
+        damaged = False
+        if path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                objs_json = serializer.loads(f.read())
+                for obj_id, obj_json in objs_json.items():
+                    DATA[s_class][obj_id] = build(**obj_json)
+        # A journal left over by an interrupted compaction comes first
+        for journal in (journal_path + ".old", journal_path):
+            if not path.exists(journal):
+                continue
+            with open(journal, 'rb') as f:
+                for line in f:
+                    try:
+                        obj_id, obj_json = serializer.loads(line)
+                    except (ValueError, TypeError):
+                        damaged = damaged or bool(line.strip())
+                        continue
+                    changes += 1
+                    if obj_json is None:
+                        DATA[s_class].pop(obj_id, None)
+                    else:
+                        DATA[s_class][obj_id] = build(**obj_json)
+        JOURNAL_SIZES[s_class] = changes
+        for obj_id, obj in DATA[s_class].items():
+            if isinstance(obj, dict):
+                cls._index_values(obj_id, cls._indexed_values(obj))
+            else:
+                obj._index()
+        if damaged:
+            cls.save_to_file()
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
+
+        The snapshot holds every change, so the journals are dropped: left
+        behind, they would replay older states over it on the next load.
+        Appends wait meanwhile, so none is lost with them.
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        with JOURNAL_LOCK:
+            cls._write_snapshot()
+            for journal in (journal_path + ".old", journal_path):
+                if path.exists(journal):
+                    remove(journal)
+            JOURNAL_SIZES[s_class] = 0
+
+    @classmethod
+    def _write_snapshot(cls):
+        """ Write all objects to .db_<Class>.json, atomically
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
         objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        for obj_id, obj in list(DATA[s_class].items()):
+            if isinstance(obj, dict):
+                objs_json[obj_id] = obj
+            else:
+                objs_json[obj_id] = obj.to_json(True)
+
+        with open(file_path + ".tmp", 'wb') as f:
+            f.write(serializer.dumps(objs_json))
+        replace(file_path + ".tmp", file_path)
+
+    @classmethod
+    def append_to_journal(cls, obj_id: str, obj_json: dict = None):
+        """ Append the new state of one object to the journal, None for a
+        removed object, and start a compaction every COMPACT_EVERY changes
+
+        The entry starts on a new line even if the journal ends with a line
+        cut short by a crash, so that load_from_file only skips that line.
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        entry = serializer.dumps([obj_id, obj_json]) + b"\n"
+        with JOURNAL_LOCK:
+            with open(journal_path, 'ab+') as f:
+                if f.seek(0, 2) > 0:
+                    f.seek(-1, 2)
+                    if f.read(1) != b"\n":
+                        entry = b"\n" + entry
+                f.write(entry)
+            JOURNAL_SIZES[s_class] = JOURNAL_SIZES.get(s_class, 0) + 1
+            if JOURNAL_SIZES[s_class] < COMPACT_EVERY:
+                return
+            JOURNAL_SIZES[s_class] = 0
+        threading.Thread(target=cls.compact, daemon=True).start()
+
+    @classmethod
+    def compact(cls):
+        """ Fold the journal into a new snapshot of all objects
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+        The journal is set aside before the snapshot is taken, so changes
+        made meanwhile go to a new journal; replaying them over the snapshot
+        is harmless since each entry holds the whole object. Compactions of
+        the same class run one after the other.
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        old_path = journal_path + ".old"
+        with COMPACT_LOCKS.setdefault(s_class, threading.Lock()):
+            with JOURNAL_LOCK:
+                if not path.exists(journal_path):
+                    return
+                if path.exists(old_path):
+                    with open(journal_path, 'rb') as src, \
+                            open(old_path, 'ab') as dst:
+                        dst.write(src.read())
+                    remove(journal_path)
+                else:
+                    rename(journal_path, old_path)
+            cls._write_snapshot()
+            remove(old_path)
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
+        self._index(DATA[s_class].get(self.id))
         DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        if STORAGE == "journal":
+            self.__class__.append_to_journal(self.id, self.to_json(True))
+        else:
+            self.__class__.save_to_file()
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        obj = DATA[s_class].pop(self.id, None)
+        if obj is not None:
+            self.__class__._unindex_values(
+                self.id, self.__class__._indexed_values(obj))
+            if STORAGE == "journal":
+                self.__class__.append_to_journal(self.id)
+            else:
+                self.__class__.save_to_file()
+
+    def _index(self, previous: object = None):
+        """ Add or refresh the object in the secondary indexes, in place of
+        previous, the object or loaded record indexed under its ID if any
+        """
+        cls = self.__class__
+        if previous is not None:
+            cls._unindex_values(self.id, cls._indexed_values(previous))
+        values = tuple(getattr(self, k) for k in cls.INDEXED_ATTRIBUTES)
+        cls._index_values(self.id, values)
+        self._indexed = values[0] if len(values) == 1 else values
+
+    @classmethod
+    def _indexed_values(cls, obj: object) -> tuple:
+        """ Return the values an object or a loaded record is indexed under,
+        in INDEXED_ATTRIBUTES order
+        """
+        if isinstance(obj, dict):
+            return tuple(obj.get(k) for k in cls.INDEXED_ATTRIBUTES)
+        if not hasattr(obj, '_indexed'):
+            return ()
+        if len(cls.INDEXED_ATTRIBUTES) == 1:
+            return (obj._indexed,)
+        return obj._indexed
+
+    @classmethod
+    def _unindex_values(cls, obj_id: str, values: tuple):
+        """ Remove an object ID from the secondary indexes, given the values
+        it is indexed under
+        """
+        s_class = cls.__name__
+        for index, v in zip(INDEXES[s_class].values(), values):
+            bucket = index[v]
+            if not isinstance(bucket, dict):
+                del index[v]
+                continue
+            del bucket[obj_id]
+            if len(bucket) == 1:
+                index[v] = next(iter(bucket))
+
+    @classmethod
+    def _index_values(cls, obj_id: str, values: tuple):
+        """ Index an object ID under its values of the indexed attributes,
+        given in INDEXED_ATTRIBUTES order
+        """
+        s_class = cls.__name__
+        for index, v in zip(INDEXES[s_class].values(), values):
+            bucket = index.get(v)
+            if bucket is None:
+                index[v] = obj_id
+            elif isinstance(bucket, dict):
+                bucket[obj_id] = None
+            elif bucket != obj_id:
+                index[v] = {bucket: None, obj_id: None}
 
     @classmethod
     def count(cls) -> int:
@@ -119,11 +359,22 @@ class Base():
         """ Return one object by ID
         """
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        obj = DATA[s_class].get(id)
+        if isinstance(obj, dict):
+            record = obj
+            obj = DATA[s_class][id] = cls(**record)
+            obj._index(record)
+        return obj
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        When an attribute is in INDEXED_ATTRIBUTES, only the objects saved
+        with that value are checked: the index is updated by save() and
+        remove(), not by assignments. An object whose indexed attribute was
+        changed but not saved yet is found by neither its old value nor its
+        new one until it is saved.
         """
         s_class = cls.__name__
         def _search(obj):
@@ -133,5 +384,32 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        obj_ids = DATA[s_class]
+        for k, v in attributes.items():
+            index = INDEXES[s_class].get(k)
+            if index is not None:
+                try:
+                    bucket = index.get(v)
+                except TypeError:
+                    continue
+                if bucket is None:
+                    obj_ids = ()
+                elif isinstance(bucket, dict):
+                    obj_ids = bucket
+                else:
+                    obj_ids = (bucket,)
+                break
+        return list(filter(_search, map(cls.get, list(obj_ids))))
+
+
+@lru_cache(maxsize=None)
+def _slot_names(cls: type) -> tuple:
+    """ Return the names in the __slots__ of a class and of its parents,
+    base classes first
+    """
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        names.extend((slots,) if isinstance(slots, str) else slots)
+    return tuple(names)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+""" Hashers module: password hashing schemes used by models
+"""
+from os import getenv
+from typing import Dict, Tuple
+import base64
+import hashlib
+import hmac
+import os
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+
+# bcrypt cost factor of new bcrypt hashes
+BCRYPT_ROUNDS = int(getenv("MODELS_BCRYPT_ROUNDS", 12))
+# scrypt parameters: log2 of the CPU/memory cost, block size, parallelism
+SCRYPT_LN = int(getenv("MODELS_SCRYPT_LN", 14))
+SCRYPT_R = int(getenv("MODELS_SCRYPT_R", 8))
+SCRYPT_P = int(getenv("MODELS_SCRYPT_P", 1))
+
+
+class Sha256Hasher:
+    """ Unsalted SHA256 hex digest, the original scheme of User. Its hashes
+    have no prefix: any hash no other hasher claims is checked as SHA256
+    """
+
+    prefixes: Tuple[str, ...] = ()
+
+    def hash(self, password: str) -> str:
+        """ Hash a password
+        """
+        return hashlib.sha256(password.encode()).hexdigest().lower()
+
+    def verify(self, hashed_password: str, password: str) -> bool:
+        """ Check a password against a hash of this hasher
+        """
+        return hmac.compare_digest(self.hash(password),
+                                   hashed_password.lower())
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """ SHA256 has no parameters to update
+        """
+        return False
+
+
+class ScryptHasher:
+    """ scrypt hasher, producing hashes like
+    "$scrypt$ln=<log2 n>,r=<r>,p=<p>$<salt>$<hash>", with base64 encoded
+    salt and hash
+    """
+
+    prefixes: Tuple[str, ...] = ('$scrypt$',)
+
+    def hash(self, password: str) -> str:
+        """ Hash a password with a new salt at SCRYPT_LN, SCRYPT_R, SCRYPT_P
+        """
+        salt = os.urandom(16)
+        digest = self._derive(password, salt, SCRYPT_LN, SCRYPT_R, SCRYPT_P)
+        return "$scrypt$ln={},r={},p={}${}${}".format(
+            SCRYPT_LN, SCRYPT_R, SCRYPT_P,
+            base64.b64encode(salt).decode(), base64.b64encode(digest).decode())
+
+    def verify(self, hashed_password: str, password: str) -> bool:
+        """ Check a password against a hash of this hasher
+        """
+        (ln, r, p), salt, digest = self._parse(hashed_password)
+        return hmac.compare_digest(self._derive(password, salt, ln, r, p),
+                                   digest)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """ Tell whether a hash was made with other parameters
+        """
+        params = self._parse(hashed_password)[0]
+        return params != (SCRYPT_LN, SCRYPT_R, SCRYPT_P)
+
+    @staticmethod
+    def _parse(hashed_password: str) -> Tuple[Tuple[int, int, int],
+                                              bytes, bytes]:
+        """ Split a hash into its (ln, r, p) parameters, salt and digest
+        """
+        _, _, params, salt, digest = hashed_password.split('$')
+        values = dict(param.split('=') for param in params.split(','))
+        return ((int(values['ln']), int(values['r']), int(values['p'])),
+                base64.b64decode(salt), base64.b64decode(digest))
+
+    @staticmethod
+    def _derive(password: str, salt: bytes, ln: int, r: int, p: int) -> bytes:
+        """ Run scrypt, allowing the 128 * r * (n + p + 2) bytes OpenSSL
+        needs plus 1 MiB of headroom
+        """
+        n = 1 << ln
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * r * (n + p + 2) + (1 << 20),
+                              dklen=32)
+
+
+class BcryptHasher:
+    """ bcrypt hasher, producing "$2b$<rounds>$..." hashes
+    """
+
+    prefixes: Tuple[str, ...] = ('$2a$', '$2b$', '$2y$')
+
+    def hash(self, password: str) -> str:
+        """ Hash a password with a new salt at BCRYPT_ROUNDS
+        """
+        return bcrypt.hashpw(password.encode(),
+                             bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+
+    def verify(self, hashed_password: str, password: str) -> bool:
+        """ Check a password against a hash of this hasher
+        """
+        return bcrypt.checkpw(password.encode(), hashed_password.encode())
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """ Tell whether a hash was made with another cost
+        """
+        return int(hashed_password.split('$')[2]) != BCRYPT_ROUNDS
+
+
+# Registered hashers: name -> hasher. bcrypt is only there when installed
+HASHERS: Dict[str, object] = {
+    'sha256': Sha256Hasher(),
+    'scrypt': ScryptHasher(),
+}
+if bcrypt is not None:
+    HASHERS['bcrypt'] = BcryptHasher()
+
+# Hasher of new passwords. SHA256 stays the default since Basic auth checks
+# the password on every request; stored hashes of any hasher stay valid
+HASHER = getenv("MODELS_PASSWORD_HASHER", 'sha256')
+
+
+def use(name: str):
+    """ Switch new passwords to another registered hasher
+    """
+    global HASHER
+    if name not in HASHERS:
+        raise ValueError("Unknown password hasher: {}".format(name))
+    HASHER = name
+
+
+def register_hasher(name: str, hasher: object):
+    """ Register a hasher: an object with a prefixes tuple and hash, verify
+    and needs_rehash methods, like ScryptHasher
+    """
+    HASHERS[name] = hasher
+
+
+def hasher_for(hashed_password: str) -> object:
+    """ Find the hasher of a hash from its prefix, SHA256 without prefix
+    """
+    for hasher in HASHERS.values():
+        if hasher.prefixes and hashed_password.startswith(hasher.prefixes):
+            return hasher
+    if hashed_password.startswith('$'):
+        raise ValueError("Unknown password hash format")
+    return HASHERS['sha256']
+
+
+def hash_password(password: str) -> str:
+    """ Hash a password with the current hasher
+    """
+    return HASHERS[HASHER].hash(password)
+
+
+def verify_password(hashed_password: str, password: str) -> bool:
+    """ Check a password against a hash of any registered hasher
+    """
+    return hasher_for(hashed_password).verify(hashed_password, password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """ Tell whether a hash was made by another hasher than the current one,
+    or with other parameters
+    """
+    hasher = hasher_for(hashed_password)
+    return hasher is not HASHERS[HASHER] or \
+        hasher.needs_rehash(hashed_password)
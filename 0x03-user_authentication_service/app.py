@@ -10,6 +10,14 @@ app = Flask(__name__)
 AUTH = Auth()
 
 
+@app.teardown_appcontext
+def release_db_session(exception: BaseException = None) -> None:
+    """
+    Close the database session of the request thread
+    """
+    AUTH.release_db_session()
+
+
 @app.route('/', methods=['GET'], strict_slashes=False)
 def index() -> str:
     """
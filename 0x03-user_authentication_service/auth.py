@@ -3,26 +3,47 @@
 Auth module
 """
 import bcrypt
+import hashers
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from db import DB
 from user import User, Base
 from sqlalchemy.orm.exc import NoResultFound
 from uuid import uuid4
 
 
-def _hash_password(password: str) -> bytes:
+logger = logging.getLogger(__name__)
+
+
+def _hash_password(password: str, rounds: int = None) -> bytes:
     """
-    Hashes the input password using bcrypt with salt.
+    Hashes the input password with salt, with the PASSWORD_HASHER of
+    hashers, bcrypt by default.
 
     Args:
         password (str): The password string to be hashed.
+        rounds (int): Force a bcrypt hash at this cost factor. The hasher
+            and its parameters are recorded in the hash, so stored hashes
+            stay valid whatever the current settings.
 
     Returns:
         bytes: The salted hash of the input password.
     """
-    # Generate a salt and hash the password
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed_password
+    if rounds is not None:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+    return hashers.hash_password(password)
+
+
+def _log_failure(future: Future) -> None:
+    """
+    Log the exception of a background task, if it failed.
+
+    Args:
+        future (Future): The future of the finished task.
+    """
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Background password rehash failed",
+                     exc_info=future.exception())
 
 
 def _generate_uuid() -> str:
@@ -45,6 +66,8 @@ class Auth:
         Initialize a new Auth instance.
         """
         self._db = DB()
+        # Rehashes of outdated password hashes run here, off the login path
+        self._rehash_executor = ThreadPoolExecutor(max_workers=1)
 
     def register_user(self, email: str, password: str) -> User:
         """
@@ -76,15 +99,51 @@ class Auth:
             email (str): The email of the user.
             password (str): The password of the user.
 
+        When the password is valid but its hash was made by another hasher
+        than PASSWORD_HASHER, or with other parameters (e.g. another cost
+        than BCRYPT_ROUNDS), a new hash is computed and stored in the
+        background, so the login itself does not pay for it. Failures of
+        the background update are logged.
+
         Returns:
             bool: True if the user's information is valid, False otherwise.
         """
         try:
             user = self._db.find_user_by(email=email)
-            return bcrypt.checkpw(password.encode('utf-8'),
-                                  user.hashed_password)
+            valid = hashers.verify_password(user.hashed_password, password)
         except NoResultFound:
             return False
+        if valid and hashers.needs_rehash(user.hashed_password):
+            future = self._rehash_executor.submit(
+                self._rehash, user.id, user.hashed_password, password)
+            future.add_done_callback(_log_failure)
+        return valid
+
+    def _rehash(self, user_id: int, hashed_password: bytes,
+                password: str) -> None:
+        """
+        Hash a password again with the current hasher and store the new
+        hash, unless the stored hash changed meanwhile, e.g. because the
+        password was reset.
+
+        Args:
+            user_id (int): The ID of the user.
+            hashed_password (bytes): The stored hash the password matched.
+            password (str): The password, known to match hashed_password.
+        """
+        try:
+            self._db.update_user_where(
+                user_id, {'hashed_password': hashed_password},
+                hashed_password=_hash_password(password))
+        finally:
+            self._db.remove_session()
+
+    def release_db_session(self) -> None:
+        """
+        Close the database session of the current thread, so that the next
+        request on it reads fresh rows, e.g. a hash updated by a rehash.
+        """
+        self._db.remove_session()
 
     def create_session(self, email: str) -> str:
         """
@@ -4,7 +4,7 @@ DB module
 """
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.session import Session
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import InvalidRequestError
@@ -22,16 +22,21 @@ class DB:
         self._engine = create_engine("sqlite:///a.db", echo=False)
         Base.metadata.drop_all(self._engine)
         Base.metadata.create_all(self._engine)
-        self.__session = None
+        # One session per thread, so that background work such as rehashes
+        # never uses the session, and SQLite connection, of a request
+        self.__session = scoped_session(sessionmaker(bind=self._engine))
 
     @property
     def _session(self) -> Session:
-        """Memoized session object
+        """Memoized session object of the current thread
         """
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        return self.__session()
+
+    def remove_session(self) -> None:
+        """Close the session of the current thread, e.g. at the end of a
+        background task
+        """
+        self.__session.remove()
 
     def add_user(self, email: str, hashed_password: str) -> User:
         """Add a new user to the database.
@@ -91,3 +96,28 @@ class DB:
                 raise ValueError
             setattr(user_to_update, key, value)
         self._session.commit()
+
+    def update_user_where(self, user_id: int, where: dict, **kwargs) -> bool:
+        """Update user attributes based on user_id, only if the user still
+        has the values given in where, in a single UPDATE statement.
+
+        Args:
+            user_id (int): The ID of the user to update.
+            where (dict): The attribute values the user must still have.
+            **kwargs: Arbitrary keyword arguments containing user attributes
+            to update.
+
+        Returns:
+            bool: True if the user was updated, False if it was not found or
+            no longer has the expected values.
+
+        Raises:
+            ValueError: If an invalid argument is passed.
+        """
+        for key in kwargs:
+            if not hasattr(User, key):
+                raise ValueError
+        updated = self._session.query(User).filter_by(
+            id=user_id, **where).update(kwargs)
+        self._session.commit()
+        return updated == 1
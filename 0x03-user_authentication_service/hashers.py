@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Hashers module: the password hashing schemes of the service
+"""
+import base64
+import bcrypt
+import hashlib
+import hmac
+import os
+from typing import Dict, Tuple
+
+
+# Name of the hasher used for new hashes, see HASHERS
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "bcrypt")
+# bcrypt cost factor of new hashes, e.g. as calibrated for the host by
+# 0x00-personal_data/encrypt_password.py
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# scrypt parameters: log2 of the CPU/memory cost, block size, parallelism
+SCRYPT_LN = int(os.getenv("SCRYPT_LN", 14))
+SCRYPT_R = int(os.getenv("SCRYPT_R", 8))
+SCRYPT_P = int(os.getenv("SCRYPT_P", 1))
+
+
+class BcryptHasher:
+    """
+    bcrypt password hasher, producing "$2b$<rounds>$..." hashes.
+    """
+
+    prefixes = (b'$2a$', b'$2b$', b'$2y$')
+
+    def hash(self, password: bytes) -> bytes:
+        """
+        Hash a password with a new salt at BCRYPT_ROUNDS.
+
+        Args:
+            password (bytes): The encoded password.
+
+        Returns:
+            bytes: The self-describing hash.
+        """
+        return bcrypt.hashpw(password, bcrypt.gensalt(BCRYPT_ROUNDS))
+
+    def verify(self, hashed_password: bytes, password: bytes) -> bool:
+        """
+        Check a password against a hash made by this hasher.
+
+        Args:
+            hashed_password (bytes): The stored hash.
+            password (bytes): The encoded password.
+
+        Returns:
+            bool: True if the password matches the hash, False otherwise.
+        """
+        return bcrypt.checkpw(password, hashed_password)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """
+        Tell whether a hash was made with another cost than BCRYPT_ROUNDS.
+
+        Args:
+            hashed_password (bytes): The stored hash.
+
+        Returns:
+            bool: True if the password should be hashed again.
+        """
+        return int(hashed_password.split(b'$')[2]) != BCRYPT_ROUNDS
+
+
+class ScryptHasher:
+    """
+    scrypt password hasher, producing
+    "$scrypt$ln=<log2 n>,r=<r>,p=<p>$<salt>$<hash>" hashes with base64
+    encoded salt and hash.
+    """
+
+    prefixes = (b'$scrypt$',)
+
+    def hash(self, password: bytes) -> bytes:
+        """
+        Hash a password with a new salt at SCRYPT_LN, SCRYPT_R and SCRYPT_P.
+
+        Args:
+            password (bytes): The encoded password.
+
+        Returns:
+            bytes: The self-describing hash.
+        """
+        salt = os.urandom(16)
+        digest = self._derive(password, salt, SCRYPT_LN, SCRYPT_R, SCRYPT_P)
+        return b'$scrypt$ln=%d,r=%d,p=%d$%s$%s' % (
+            SCRYPT_LN, SCRYPT_R, SCRYPT_P,
+            base64.b64encode(salt), base64.b64encode(digest))
+
+    def verify(self, hashed_password: bytes, password: bytes) -> bool:
+        """
+        Check a password against a hash made by this hasher.
+
+        Args:
+            hashed_password (bytes): The stored hash.
+            password (bytes): The encoded password.
+
+        Returns:
+            bool: True if the password matches the hash, False otherwise.
+        """
+        (ln, r, p), salt, digest = self._parse(hashed_password)
+        return hmac.compare_digest(
+            self._derive(password, salt, ln, r, p), digest)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """
+        Tell whether a hash was made with other parameters than the current
+        ones.
+
+        Args:
+            hashed_password (bytes): The stored hash.
+
+        Returns:
+            bool: True if the password should be hashed again.
+        """
+        params = self._parse(hashed_password)[0]
+        return params != (SCRYPT_LN, SCRYPT_R, SCRYPT_P)
+
+    @staticmethod
+    def _parse(hashed_password: bytes) -> Tuple[Tuple[int, int, int],
+                                                bytes, bytes]:
+        """
+        Split a scrypt hash into its parameters, salt and digest.
+
+        Args:
+            hashed_password (bytes): The stored hash.
+
+        Returns:
+            Tuple: The (ln, r, p) parameters, the salt and the digest.
+        """
+        _, _, params, salt, digest = hashed_password.split(b'$')
+        values = dict(param.split(b'=') for param in params.split(b','))
+        return ((int(values[b'ln']), int(values[b'r']), int(values[b'p'])),
+                base64.b64decode(salt), base64.b64decode(digest))
+
+    @staticmethod
+    def _derive(password: bytes, salt: bytes, ln: int, r: int,
+                p: int) -> bytes:
+        """
+        Run scrypt with the given parameters.
+
+        OpenSSL needs 128 * r * (n + p + 2) bytes; maxmem allows that plus
+        1 MiB of headroom.
+
+        Args:
+            password (bytes): The encoded password.
+            salt (bytes): The salt.
+            ln (int): log2 of the CPU/memory cost.
+            r (int): The block size.
+            p (int): The parallelism.
+
+        Returns:
+            bytes: The 32 bytes digest.
+        """
+        n = 1 << ln
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * r * (n + p + 2) + (1 << 20),
+                              dklen=32)
+
+
+# Registered hashers, by name. Stored hashes are matched to their hasher by
+# prefix, so changing PASSWORD_HASHER keeps older hashes valid.
+HASHERS: Dict[str, object] = {
+    'bcrypt': BcryptHasher(),
+    'scrypt': ScryptHasher(),
+}
+
+
+def register_hasher(name: str, hasher: object) -> None:
+    """
+    Register a password hasher, making its hashes verifiable and its name
+    usable as PASSWORD_HASHER.
+
+    Args:
+        name (str): The name of the hasher.
+        hasher (object): An object with a prefixes tuple and hash, verify and
+            needs_rehash methods, like BcryptHasher.
+    """
+    HASHERS[name] = hasher
+
+
+def hasher_for(hashed_password: bytes) -> object:
+    """
+    Find the hasher that made a hash, from the prefix of the hash.
+
+    Args:
+        hashed_password (bytes): The stored hash.
+
+    Returns:
+        object: The registered hasher.
+
+    Raises:
+        ValueError: If no registered hasher knows the prefix of the hash.
+    """
+    for hasher in HASHERS.values():
+        if hashed_password.startswith(hasher.prefixes):
+            return hasher
+    raise ValueError("Unknown password hash format")
+
+
+def hash_password(password: str) -> bytes:
+    """
+    Hash a password with the PASSWORD_HASHER of HASHERS.
+
+    Args:
+        password (str): The password string to be hashed.
+
+    Returns:
+        bytes: The self-describing, salted hash of the password.
+    """
+    return HASHERS[PASSWORD_HASHER].hash(password.encode('utf-8'))
+
+
+def verify_password(hashed_password: bytes, password: str) -> bool:
+    """
+    Check a password against a hash made by any registered hasher.
+
+    Args:
+        hashed_password (bytes): The stored hash.
+        password (str): The password to check.
+
+    Returns:
+        bool: True if the password matches the hash, False otherwise.
+    """
+    return hasher_for(hashed_password).verify(hashed_password,
+                                              password.encode('utf-8'))
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """
+    Tell whether a hash was made by another hasher than PASSWORD_HASHER, or
+    with other parameters than its current ones (e.g. BCRYPT_ROUNDS).
+
+    Args:
+        hashed_password (bytes): The stored hash.
+
+    Returns:
+        bool: True if the password should be hashed again.
+    """
+    hasher = hasher_for(hashed_password)
+    return hasher is not HASHERS[PASSWORD_HASHER] or \
+        hasher.needs_rehash(hashed_password)